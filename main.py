@@ -1,36 +1,359 @@
+import asyncio
+import atexit
+import functools
 import io
 import os
+import tempfile
 import uuid
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+import aiofiles
+import httpx
+import numpy as np
+from dotenv import load_dotenv
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
-from PIL import Image
+from oauthlib import oauth1
+from PIL import Image, features
 import uvicorn
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s [%(levelname)s] %(message)s")
+# Set up logging. Records go through a queue: hot-path logger calls only
+# enqueue, and the locking stderr write happens on one background thread,
+# so worker threads and tasks never serialize on I/O. The listener starts
+# at import (not ASGI startup) so records from module init and from the
+# uvicorn supervisor process are drained too; atexit flushes it on exit.
+# Default to INFO so the per-resize debug lines cost nothing in production.
+_log_queue = queue.Queue(-1)
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+_root_logger = logging.getLogger()
+_root_logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+_root_logger.addHandler(QueueHandler(_log_queue))
+_log_listener = QueueListener(_log_queue, _stream_handler, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
+# With Pillow-SIMD built against libjpeg-turbo, JPEG decode/encode and the
+# Lanczos resample run on SIMD kernels. Log whether the turbo codec is active
+# so a plain-Pillow fallback install is easy to spot.
+if features.check_feature("libjpeg_turbo"):
+    logger.info("libjpeg-turbo detected: SIMD JPEG codec paths are enabled.")
+else:
+    logger.warning("libjpeg-turbo not detected: JPEG codec will use scalar paths.")
+
 app = FastAPI()
 
 # Ensure a static directory exists to serve uploaded images
 STATIC_DIR = "static"
 if not os.path.exists(STATIC_DIR):
     os.makedirs(STATIC_DIR)
-    logger.info(f"Created directory: {STATIC_DIR}")
+    logger.info("Created directory: %s", STATIC_DIR)
 
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
+# Twitter API credentials; the media upload step is skipped when they are unset
+load_dotenv()
+TWITTER_API_KEY = os.getenv("TWITTER_API_KEY")
+TWITTER_API_SECRET = os.getenv("TWITTER_API_SECRET")
+TWITTER_ACCESS_TOKEN = os.getenv("TWITTER_ACCESS_TOKEN")
+TWITTER_ACCESS_TOKEN_SECRET = os.getenv("TWITTER_ACCESS_TOKEN_SECRET")
+
+MEDIA_UPLOAD_URL = "https://upload.twitter.com/1.1/media/upload.json"
+
+# Backpressure: each request holds four resized buffers plus their JPEGs in
+# flight, so bound how many requests fan out into the thread pool at once
+# and how many media uploads run concurrently, instead of letting N clients
+# x 4 sizes of pixel data pile up until the worker OOMs
+_RESIZE_SEM = asyncio.Semaphore((os.cpu_count() or 1) * 2)
+_UPLOAD_SEM = asyncio.Semaphore(5)
+
+def twitter_configured() -> bool:
+    """
+    Return True when all four Twitter credentials are set.
+    """
+    return all([TWITTER_API_KEY, TWITTER_API_SECRET,
+                TWITTER_ACCESS_TOKEN, TWITTER_ACCESS_TOKEN_SECRET])
+
+@functools.lru_cache(maxsize=1)
+def _oauth_signer() -> oauth1.Client:
+    """
+    Build the OAuth1 signer once; signing itself is stateless per request.
+    """
+    return oauth1.Client(
+        TWITTER_API_KEY,
+        client_secret=TWITTER_API_SECRET,
+        resource_owner_key=TWITTER_ACCESS_TOKEN,
+        resource_owner_secret=TWITTER_ACCESS_TOKEN_SECRET,
+    )
+
+@functools.lru_cache(maxsize=1)
+def _twitter_client() -> httpx.AsyncClient:
+    """
+    Shared AsyncClient for Twitter uploads. Creating it once means the
+    connection pool keeps persistent HTTPS connections to upload.twitter.com,
+    so repeat uploads skip the TLS handshake entirely.
+    """
+    return httpx.AsyncClient(timeout=30.0)
+
+def _sign_media_upload() -> dict:
+    """
+    Build an OAuth1-signed Authorization header for the media upload endpoint.
+    The multipart body is excluded from the signature base, so only the URL
+    and OAuth parameters are signed.
+    """
+    _, headers, _ = _oauth_signer().sign(MEDIA_UPLOAD_URL, http_method="POST")
+    return {"Authorization": headers["Authorization"]}
+
+async def _upload_one(client: httpx.AsyncClient, jpeg_bytes: bytes, filename: str) -> int:
+    """
+    Upload a single encoded JPEG to Twitter's media endpoint and return its
+    media_id.
+    """
+    logger.debug("Uploading %s (%d bytes) to Twitter...", filename, len(jpeg_bytes))
+    async with _UPLOAD_SEM:
+        response = await client.post(
+            MEDIA_UPLOAD_URL,
+            headers=_sign_media_upload(),
+            files={"media": (filename, jpeg_bytes, "image/jpeg")},
+        )
+    response.raise_for_status()
+    media_id = response.json()["media_id"]
+    logger.info("Uploaded %s to Twitter with media_id %s.", filename, media_id)
+    return media_id
+
+async def post_images_to_twitter(image_buffers: list) -> list:
+    """
+    Upload the encoded JPEGs to Twitter concurrently and return their media
+    ids. The uploads are independent HTTPS POSTs, so dispatching them with
+    asyncio.gather overlaps network latency instead of paying a full round
+    trip per image; the shared client keeps its connections alive across
+    requests. All uploads run to completion before the first failure is
+    re-raised, so an error in one does not leave its siblings dangling.
+    """
+    client = _twitter_client()
+    results = await asyncio.gather(
+        *[
+            _upload_one(client, jpeg_bytes, f"img_{idx}.jpg")
+            for idx, jpeg_bytes in enumerate(image_buffers)
+        ],
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return list(results)
+
+# Preset ad-unit sizes generated for every upload
+TARGET_SIZES = [(300, 250), (728, 90), (160, 600), (300, 600)]
+
+# Upload validation: trust magic bytes, not the client-supplied content type
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+JPEG_MAGIC = b"\xff\xd8\xff"
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+# Optional GPU resize path: separable Lanczos3 expressed as two banded
+# matmuls, useful when batches of large sources are processed. Off by
+# default; enable with RESIZE_USE_GPU=1 on a host with torch + CUDA
+# installed (torch is deliberately not in requirements.txt).
+RESIZE_USE_GPU = os.getenv("RESIZE_USE_GPU", "0") == "1"
+GPU_MIN_EDGE = 512
+
+@functools.lru_cache(maxsize=1)
+def _gpu_available() -> bool:
+    """
+    Return True when the GPU path is enabled and torch sees a CUDA device.
+    """
+    if not RESIZE_USE_GPU:
+        return False
+    try:
+        import torch
+    except ImportError:
+        logger.warning("RESIZE_USE_GPU is set but torch is not installed; using CPU resize.")
+        return False
+    return torch.cuda.is_available()
+
+@functools.lru_cache(maxsize=64)
+def _lanczos_weights(src: int, dst: int):
+    """
+    Build the dense (dst, src) Lanczos3 resample matrix for one axis. Each
+    output row holds the normalized filter taps for one destination pixel,
+    so applying the matrix as a matmul resamples every column at once.
+    Cached because the service only targets a handful of fixed sizes and
+    source resolutions repeat across uploads; only the GPU path consumes
+    these, and callers must not mutate the returned array.
+    """
+    scale = src / dst
+    support = 3.0 * max(scale, 1.0)
+    weights = np.zeros((dst, src), dtype=np.float32)
+    for i in range(dst):
+        center = (i + 0.5) * scale
+        lo = max(int(center - support), 0)
+        hi = min(int(center + support) + 1, src)
+        x = (np.arange(lo, hi) + 0.5 - center) / max(scale, 1.0)
+        taps = np.sinc(x) * np.sinc(x / 3.0)
+        weights[i, lo:hi] = taps / taps.sum()
+    return weights
+
+def _resize_gpu(image: Image.Image, size: tuple) -> Image.Image:
+    """
+    Lanczos3 resize on the GPU: upload the RGB planes once, then apply the
+    vertical and horizontal weight matrices as two batched matmuls.
+    """
+    import torch
+    arr = np.asarray(image.convert("RGB"), dtype=np.float32)
+    w_v = torch.from_numpy(_lanczos_weights(arr.shape[0], size[1])).cuda()
+    w_h = torch.from_numpy(_lanczos_weights(arr.shape[1], size[0])).cuda()
+    planes = torch.from_numpy(arr).cuda().permute(2, 0, 1)
+    out = w_v @ planes @ w_h.T
+    # round before the byte cast: plain truncation biases output darker
+    out = out.clamp(0, 255).round().byte().permute(1, 2, 0).cpu().numpy()
+    return Image.fromarray(out)
+
+# Optional Rust resize backend: the fast_image_resize crate's Python wheel
+# ships runtime-dispatched AVX2/SSE4/NEON Lanczos kernels that beat Pillow
+# on u8 RGB. Like torch, it is not in requirements.txt; Pillow remains the
+# fallback when the wheel is unavailable on the platform. The constructor
+# stays inside the try so a wheel with an unexpected API disables the
+# backend instead of breaking the import.
+try:
+    import fast_image_resize as fir
+    _FIR_RESIZER = fir.Resizer(fir.Algorithm.Lanczos3)
+except Exception:
+    _FIR_RESIZER = None
+
+# Optional direct libjpeg-turbo encoder: one TurboJPEG instance reused for
+# every encode skips Pillow's per-save compressor setup. Needs both the
+# PyTurboJPEG wheel and the native turbojpeg library, so Pillow's save stays
+# the fallback.
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420
+    _TJ = TurboJPEG()
+except Exception:
+    _TJ = None
+
+def build_master(image: Image.Image, sizes: list) -> Image.Image:
+    """
+    Downscale the original once to a "master" intermediate that keeps every
+    target dimension with 2x headroom for Lanczos quality, bounding width
+    and height separately so extreme aspect ratios are not collapsed. The
+    per-size resizes then read this much smaller buffer instead of
+    re-reading the full-resolution original for every target. Sources that
+    cannot satisfy both bounds are returned unchanged.
+    """
+    master_w_min = max(w for (w, h) in sizes) * 2
+    master_h_min = max(h for (w, h) in sizes) * 2
+    src_w, src_h = image.size
+    scale = max(master_w_min / src_w, master_h_min / src_h)
+    if scale >= 1.0:
+        logger.debug("Original %s already within master bounds %dx%d; skipping master resize.",
+                     image.size, master_w_min, master_h_min)
+        return image
+
+    # Integer box reduction first: shrink by the largest power of two that
+    # keeps both edges at or above their master bounds. reduce() is far
+    # cheaper than Lanczos and, unlike draft(), also shrinks PNG sources,
+    # so the full-resolution bitmap never feeds the convolution directly.
+    factor = 1
+    while (src_w // (factor * 2) >= master_w_min
+           and src_h // (factor * 2) >= master_h_min):
+        factor *= 2
+    if factor > 1:
+        logger.debug("Box-reducing original %s by %d before the master resize.", image.size, factor)
+        image = image.reduce(factor)
+        src_w, src_h = image.size
+        scale = max(master_w_min / src_w, master_h_min / src_h)
+
+    master_size = (max(1, round(src_w * scale)), max(1, round(src_h * scale)))
+    logger.debug("Downscaling original %s to master %s...", image.size, master_size)
+    return image.resize(master_size, resample=Image.Resampling.LANCZOS)
+
 def resize_image(image: Image.Image, size: tuple) -> Image.Image:
     """
     Resizes the given image to the specified size using a high-quality Lanczos filter.
     """
-    logger.debug(f"Resizing image to {size}...")
-    resized = image.resize(size, resample=Image.Resampling.LANCZOS)
+    logger.debug("Resizing image to %s...", size)
+    # Large sources can take the GPU matmul path when it is enabled; small
+    # thumbnails are faster on the CPU than a round trip over PCIe
+    if _gpu_available() and min(image.size) >= GPU_MIN_EDGE:
+        try:
+            return _resize_gpu(image, size)
+        except Exception as e:
+            logger.warning("GPU resize failed (%s); falling back to CPU.", e)
+    if _FIR_RESIZER is not None:
+        try:
+            arr = _FIR_RESIZER.resize(np.asarray(image.convert("RGB")), size)
+            return Image.fromarray(arr)
+        except Exception as e:
+            logger.warning("fast_image_resize failed (%s); falling back to Pillow.", e)
+    # reducing_gap lets Pillow do a cheap integer box reduce first, so the
+    # expensive Lanczos convolution only runs on a near-target-size input
+    resized = image.resize(size, resample=Image.Resampling.LANCZOS, reducing_gap=3.0)
     logger.debug("Image resized successfully.")
     return resized
 
+def _decode_and_prepare(spool) -> Image.Image:
+    """
+    Decode the spooled upload, drop alpha/palette, and build the master
+    intermediate. Like _resize_and_encode this runs on a worker thread: the
+    full decode and the master Lanczos pass are the heaviest per-request
+    work, and Pillow releases the GIL around both.
+    """
+    image = Image.open(spool)
+    logger.info("Image file opened successfully.")
+
+    # For JPEG sources, ask libjpeg to decode at a reduced scale: draft()
+    # runs the IDCT at 1/2, 1/4 or 1/8 resolution, so a large original
+    # never gets decoded at full size. The target scales the source
+    # dimensions down to the master's per-axis 2x headroom, preserving
+    # the aspect ratio so the reduced IDCT scales can actually engage.
+    # draft() is a no-op for PNG.
+    min_w = max(w for (w, h) in TARGET_SIZES) * 2
+    min_h = max(h for (w, h) in TARGET_SIZES) * 2
+    src_w, src_h = image.size
+    draft_scale = max(min_w / src_w, min_h / src_h)
+    if draft_scale < 1.0:
+        image.draft("RGB", (round(src_w * draft_scale), round(src_h * draft_scale)))
+    image.load()
+    logger.debug("Image decoded at %s.", image.size)
+
+    # Drop alpha/palette up front so the Lanczos passes run on 3 channels,
+    # not 4, and each size is not converted separately after its resize
+    if image.mode not in ("RGB", "L"):
+        logger.debug("Converting image mode from %s to RGB for JPEG compatibility.", image.mode)
+        image = image.convert("RGB")
+
+    # Resize the original once to a master intermediate, then produce each
+    # preset size from it instead of re-reading the full-resolution source
+    return build_master(image, TARGET_SIZES)
+
+def _resize_and_encode(image: Image.Image, size: tuple) -> bytes:
+    """
+    Resize the source to the given size and JPEG-encode it, returning the
+    encoded bytes. Intended to run on a worker thread: Pillow releases the
+    GIL around both the resize and the encode, so several of these run in
+    parallel on the default executor.
+    """
+    resized_img = resize_image(image, size)
+
+    # Encode through the shared TurboJPEG instance when available, skipping
+    # Pillow's per-save compressor setup entirely
+    if _TJ is not None:
+        if resized_img.mode != "RGB":
+            resized_img = resized_img.convert("RGB")
+        return _TJ.encode(np.asarray(resized_img), quality=82,
+                          pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
+
+    # Baseline single-pass Huffman with 4:2:0 subsampling is the encode path
+    # libjpeg-turbo accelerates; the two-pass optimize/progressive modes are
+    # wasted effort for thumbnails that Twitter re-encodes anyway
+    buf = io.BytesIO()
+    resized_img.save(buf, format="JPEG", quality=82, optimize=False,
+                     progressive=False, subsampling=2)
+    return buf.getvalue()
+
 @app.get("/", response_class=HTMLResponse)
 async def index():
     """
@@ -64,42 +387,77 @@ async def index():
 @app.post("/upload/", response_class=HTMLResponse)
 async def upload_image(file: UploadFile = File(...), request: Request = None):
     """
-    Handle image upload, resize the image, save it to the static directory, and
-    return an HTML page with a button to open Twitter's tweet composer pre-populated
-    with text and the link to the resized image.
+    Handle image upload, resize the image to each preset ad size, save them to
+    the static directory, and return an HTML page with a button to open Twitter's
+    tweet composer pre-populated with text and the link to the resized image.
     """
     logger.info("Received an image upload request.")
-    if file.content_type not in ["image/jpeg", "image/png"]:
-        logger.error(f"Unsupported file type received: {file.content_type}")
+
+    # Sniff the magic bytes before buffering the whole body, so a mislabelled
+    # or bogus upload is rejected without reading a multi-MB payload
+    head = await file.read(12)
+    if not (head.startswith(JPEG_MAGIC) or head.startswith(PNG_MAGIC)):
+        logger.error("Unsupported file type received (content-type %s).", file.content_type)
         raise HTTPException(status_code=400, detail="Unsupported file type. Only JPEG and PNG are allowed.")
 
-    # Read and open the uploaded image
-    contents = await file.read()
+    # Stream the body into a spooled buffer in 64KB chunks instead of holding
+    # one monolithic bytes object; uploads beyond 1MB spill to disk, so a big
+    # source image never sits fully resident just to be decoded
+    spool = tempfile.SpooledTemporaryFile(max_size=1 << 20)
+    spool.write(head)
+    total = len(head)
+    while chunk := await file.read(64 * 1024):
+        total += len(chunk)
+        if total > MAX_UPLOAD_BYTES:
+            logger.error("Upload exceeds the %d byte limit.", MAX_UPLOAD_BYTES)
+            raise HTTPException(status_code=413, detail="Uploaded image is too large.")
+        spool.write(chunk)
+    spool.seek(0)
+
+    # Decode, convert, and build the master on a worker thread: these are the
+    # heaviest per-request steps and previously ran inline on the event loop
     try:
-        image = Image.open(io.BytesIO(contents))
-        logger.info("Image file opened successfully.")
+        master = await asyncio.to_thread(_decode_and_prepare, spool)
     except Exception as e:
-        logger.error(f"Invalid image file: {e}")
+        logger.error("Invalid image file: %s", e)
         raise HTTPException(status_code=400, detail="Invalid image file.")
 
-    # Choose a preset size (e.g. 300x250) for the resized image
-    target_size = (300, 250)
-    resized_img = resize_image(image, target_size)
-    
-    # Ensure image is in RGB mode for JPEG compatibility
-    if resized_img.mode != "RGB":
-        logger.debug(f"Converting image mode from {resized_img.mode} to RGB for JPEG compatibility.")
-        resized_img = resized_img.convert("RGB")
-
-    # Save the resized image in the static folder with a unique filename
-    unique_filename = f"{uuid.uuid4()}.jpg"
-    save_path = os.path.join(STATIC_DIR, unique_filename)
-    resized_img.save(save_path, format="JPEG")
-    logger.info(f"Resized image saved at {save_path}")
-
-    # Build the absolute URL for the saved image using request.base_url
-    image_url = f"{request.base_url}static/{unique_filename}"
-    logger.debug(f"Image URL: {image_url}")
+    # Resize and encode the preset sizes in parallel on worker threads so the
+    # CPU-bound Pillow work does not block the event loop; the semaphore
+    # bounds how many requests hold their buffers in flight at once
+    async with _RESIZE_SEM:
+        buffers = await asyncio.gather(
+            *[asyncio.to_thread(_resize_and_encode, master, size) for size in TARGET_SIZES]
+        )
+
+    upload_id = uuid.uuid4()
+    image_urls = []
+    for size, jpeg_bytes in zip(TARGET_SIZES, buffers):
+        # Save the resized image in the static folder with a unique filename,
+        # writing through aiofiles so disk I/O does not block the event loop
+        unique_filename = f"{upload_id}_{size[0]}x{size[1]}.jpg"
+        save_path = os.path.join(STATIC_DIR, unique_filename)
+        async with aiofiles.open(save_path, "wb") as out:
+            await out.write(jpeg_bytes)
+        logger.info("Resized image saved at %s", save_path)
+
+        # Build the absolute URL for the saved image using request.base_url
+        image_urls.append(f"{request.base_url}static/{unique_filename}")
+
+    image_url = image_urls[0]
+    logger.debug("Image URLs: %s", image_urls)
+
+    # Upload the resized images to Twitter when credentials are configured.
+    # The upload is auxiliary -- the response page only links the static
+    # files -- so a Twitter failure is logged but does not fail the request.
+    if twitter_configured():
+        try:
+            media_ids = await post_images_to_twitter(buffers)
+            logger.info("Twitter media ids: %s", media_ids)
+        except httpx.HTTPError as e:
+            logger.error("Twitter media upload failed: %s", e)
+    else:
+        logger.debug("Twitter credentials not configured; skipping media upload.")
 
     # Build the Twitter intent URL with a pre-filled tweet text and the image URL
     tweet_text = "Check out this awesome image!"
@@ -109,6 +467,10 @@ async def upload_image(file: UploadFile = File(...), request: Request = None):
     logger.info("Constructed Twitter intent URL.")
 
     # Return an HTML page with a button linking to Twitter's tweet composer
+    image_links = "".join(
+        f'<li><a href="{url}" target="_blank">{size[0]}x{size[1]}</a></li>'
+        for size, url in zip(TARGET_SIZES, image_urls)
+    )
     html_response = f"""
     <html>
       <head>
@@ -149,7 +511,10 @@ async def upload_image(file: UploadFile = File(...), request: Request = None):
           <h1>Image Uploaded and Processed</h1>
           <p>Your image has been resized. Click the button below to post it on Twitter:</p>
           <a href="{twitter_intent_url}" target="_blank" class="button">Post to Twitter</a>
-          <p>Or view your image <a href="{image_url}" target="_blank">here</a>.</p>
+          <p>Or view the resized images:</p>
+          <ul>
+            {image_links}
+          </ul>
         </div>
       </body>
     </html>
@@ -158,4 +523,7 @@ async def upload_image(file: UploadFile = File(...), request: Request = None):
 
 if __name__ == "__main__":
     logger.info("Starting FastAPI application...")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # One worker per core so resize/encode scales past a single process, with
+    # uvloop and httptools replacing the default event loop and HTTP parser
+    uvicorn.run("main:app", host="0.0.0.0", port=8000,
+                workers=os.cpu_count(), loop="uvloop", http="httptools")